@@ -1,12 +1,16 @@
 import grpc
 import ollama
-import requests
-from concurrent import futures
-import time
+import httpx
+import asyncio
 import logging
 import os
-import json
-from elasticsearch import Elasticsearch, exceptions # New import
+import re
+import orjson
+import msgspec
+import hashlib
+import cachetools
+import numpy as np
+from elasticsearch import AsyncElasticsearch, exceptions # New import
 
 # Import the generated gRPC files from the 'generated' sub-directory
 from generated import agent_pb2
@@ -18,9 +22,53 @@ log = logging.getLogger(__name__)
 
 # --- Configuration ---
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://host.docker.internal:11434")
+# Quantized Llama 3 (pull on the Ollama host with `ollama pull llama3:8b-instruct-q4_K_M`)
+MODEL_NAME = os.getenv("AGENT_MODEL", "llama3:8b-instruct-q4_K_M")
+# Small model that drafts the structured tool-call turns; empty disables drafting
+DRAFT_MODEL = os.getenv("DRAFT_MODEL", "llama3.2:1b")
+# Seconds Ollama keeps the models (and their cached prompt prefix) loaded; -1 keeps them resident
+MODEL_KEEP_ALIVE = int(os.getenv("MODEL_KEEP_ALIVE", "-1"))
+# Greedy, seeded decoding (reproducible turns), keeping the whole shared prefix when the context shifts
+LLM_OPTIONS = {'temperature': 0, 'seed': 0, 'num_keep': -1}
+# Planner turns only emit one small JSON object; turns that may end in a summary get more room
+PLANNER_OPTIONS = {**LLM_OPTIONS, 'num_predict': 128, 'top_p': 1.0, 'stop': ['```']}
+SUMMARY_OPTIONS = {**LLM_OPTIONS, 'num_predict': 256}
 PAYMENT_TOOL_URL = "http://payment-tool:8000"
 ELASTICSEARCH_HOST = "http://elasticsearch:9200"
 ELASTICSEARCH_INDEX = "aegis_policies"
+ES_CONNECTIONS_PER_NODE = int(os.getenv("ES_CONNECTIONS_PER_NODE", "32")) # Pooled keep-alive connections
+# Stored search template for policy lookups, registered at connect time so ES parses it once.
+# The exists filter is cacheable; toJson escapes the LLM-written query into the body safely.
+POLICY_SEARCH_TEMPLATE_ID = "aegis_policy_search"
+POLICY_SEARCH_TEMPLATE = (
+    '{"query": {"bool": {'
+    '"filter": [{"exists": {"field": "policy_id"}}], '
+    '"must": [{"match": {"content": {{#toJson}}query{{/toJson}}}}]}}, '
+    '"size": 1, "_source": ["policy_id", "content"]}'
+)
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+EMBED_MODEL = os.getenv("EMBED_MODEL", "nomic-embed-text")
+# Off by default: a hit replays a stored summary without running any tools for the new incident
+# (no payment lookup, no escalation ticket), so only enable it where that is acceptable
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1024"))
+OLLAMA_MAX_BATCH = int(os.getenv("OLLAMA_MAX_BATCH", "16")) # Chat calls dispatched together
+OLLAMA_BATCH_WAIT_MS = int(os.getenv("OLLAMA_BATCH_WAIT_MS", "20")) # Coalescing window
+POLICY_CACHE_TTL = int(os.getenv("POLICY_CACHE_TTL", "60")) # Seconds a knowledge base answer is reused
+INFLIGHT_LOG_INTERVAL = 10 # Seconds between in-flight incident log lines
+# Policy fetched speculatively at the start of every incident, overlapping the first LLM turns
+SPECULATIVE_POLICY_QUERY = "policy for multiple payment failures"
+SPECULATIVE_POLICY_TIMEOUT = 5 # Seconds to wait for the speculative result before querying again
+MAX_CONCURRENT_TOOL_CALLS = int(os.getenv("MAX_CONCURRENT_TOOL_CALLS", "16")) # Across all incidents
+
+# Event fields that differ between otherwise identical incidents (ids, timestamps)
+VOLATILE_EVENT_FIELD = re.compile(r"(^|_)(id|ids|timestamp|time|date|at)$", re.IGNORECASE)
+# Text that precedes an id in a summary; only ids in these contexts are templatized for the semantic cache
+ID_CONTEXTS = {
+    "order_id": r"\b(?:order(?:[ _]id)?[\s:#=]*|SIM)",
+    "user_id": r"\b(?:user|customer)(?:[ _]id)?[\s:#=]*",
+}
 
 # --- Tool Definitions (Updated) ---
 # ... (Keep AVAILABLE_TOOLS exactly the same as before, including all 4 tools) ...
@@ -72,60 +120,543 @@ AVAILABLE_TOOLS = [
 ]
 
 
+# --- Tool Call Schemas ---
+# Mirror AVAILABLE_TOOLS. Ids are optional so missing ones can be filled in from the event;
+# decoding is non-strict, so ids the LLM returns as strings ("7") are coerced to int.
+class GetPaymentMethodsArgs(msgspec.Struct):
+    user_id: int | None = None
+
+class RetryPaymentArgs(msgspec.Struct):
+    order_id: int | None = None
+    payment_method_id: str | None = None
+
+class QueryKnowledgeBaseArgs(msgspec.Struct):
+    query: str = ""
+
+class EscalateToHumanArgs(msgspec.Struct):
+    order_id: int | None = None
+    reason: str = "Reason not specified"
+
+class GetPaymentMethodsCall(msgspec.Struct, tag_field="tool_name", tag="get_payment_methods"):
+    tool_args: GetPaymentMethodsArgs
+
+class RetryPaymentCall(msgspec.Struct, tag_field="tool_name", tag="retry_payment"):
+    tool_args: RetryPaymentArgs
+
+class QueryKnowledgeBaseCall(msgspec.Struct, tag_field="tool_name", tag="query_knowledge_base"):
+    tool_args: QueryKnowledgeBaseArgs
+
+class EscalateToHumanCall(msgspec.Struct, tag_field="tool_name", tag="escalate_to_human"):
+    tool_args: EscalateToHumanArgs
+
+# Parses, validates and coerces a tool call in one pass; raises msgspec.ValidationError for
+# JSON that is not a call to a known tool and msgspec.DecodeError for text that is not JSON.
+# One call per turn: Ollama's JSON mode emits a single object and the stream stops when it closes.
+_TOOL_CALL_DECODER = msgspec.json.Decoder(
+    GetPaymentMethodsCall | RetryPaymentCall | QueryKnowledgeBaseCall | EscalateToHumanCall,
+    strict=False
+)
+# Serialized once without indentation; the tool list is static, so its bytes never change
+_AVAILABLE_TOOLS_JSON = orjson.dumps(AVAILABLE_TOOLS).decode()
+
+# First message of every conversation. It holds no incident data and is never mutated, so every
+# turn of every incident shares a byte-identical prefix and Ollama reuses its KV cache for it.
+SYSTEM_MSG = {
+    'role': 'system',
+    'content': """You are 'Aegis', an agent that resolves payment failure incidents.
+Available tools: """ + _AVAILABLE_TOOLS_JSON + """
+When asked for a tool call, respond ONLY with a valid JSON object containing exactly two keys: "tool_name" (string) and "tool_args" (object)."""
+}
+
+# Second message: the incident itself, fixed for the whole incident and sent after SYSTEM_MSG.
+EVENT_PROMPT_TEMPLATE = """Incident: '{event_type}' for order_id {order_id}, user_id {user_id}.
+Event Details: {event}
+Goal: Resolve this payment failure."""
+
+# --- Turn Prompt Templates ---
+# Bound once at import; each turn only formats in its small per-turn values.
+TURN1_TEMPLATE = """Your *very first step* MUST be to call 'get_payment_methods'.
+Respond ONLY with a valid JSON object containing exactly two keys: "tool_name" (string) and "tool_args" (object).
+The value for "tool_name" must be "get_payment_methods".
+The value for "tool_args" must be an object containing the key "user_id" with the value {user_id}.
+DO NOT include descriptions, parameters, or any other keys in your JSON response."""
+
+# Follow-up prompts, keyed by the tool planned in the previous turn. Each one names the single
+# tool to call next, so none of them repeats the tool list: it lives only in the system prefix,
+# which is prefilled once and reused from Ollama's KV cache on later turns.
+FOLLOW_UP_TEMPLATES = {
+    # Turn 2: Should follow 'get_payment_methods'
+    "get_payment_methods": """Result of 'get_payment_methods': {result}
+Analyze the result.
+- If you see an 'active' payment method, your next step MUST be to call 'retry_payment'. Respond ONLY with JSON containing "tool_name": "retry_payment" and "tool_args" object including the correct order_id ({order_id}) and the active payment_method_id.
+- If there are NO 'active' methods, your next step MUST be to call 'query_knowledge_base' about the policy for 'no active backup methods'. Respond ONLY with JSON containing "tool_name": "query_knowledge_base" and "tool_args" object with the query.""",
+    # Turn 3: Should follow 'retry_payment'
+    "retry_payment": """Result of 'retry_payment': {result}
+Analyze the result.
+- If the status is 'success', provide ONLY the final summary text (NO JSON).
+- If the status is 'failed', your next step MUST be to call 'query_knowledge_base' about the policy for 'multiple payment failures'. Respond ONLY with JSON containing "tool_name": "query_knowledge_base" and "tool_args" object with the query.""",
+    # Turn 4: Should follow 'query_knowledge_base'
+    "query_knowledge_base": """Result of 'query_knowledge_base': {result}
+Analyze the policy content found. Your next step MUST be to call the 'escalate_to_human' tool.
+Respond ONLY with JSON containing "tool_name": "escalate_to_human" and "tool_args" object including the order_id ({order_id}) and a brief reason based on the policy.""",
+    # Turn 5: Should follow 'escalate_to_human' (final summary)
+    "escalate_to_human": """Result of 'escalate_to_human': {result}
+Provide ONLY the final, concise summary message based on the escalation result (NO JSON).""",
+}
+MISSING_TOOL_RESULT = '{"error": "Could not get previous tool result"}'
+
+
+def response_cache_key(event_type, event_data, raw_event_json):
+    """Builds the exact-match response cache key, ignoring key order and whitespace in the event."""
+    if event_data is None: # Unparseable events can still repeat byte-for-byte
+        canonical_event = raw_event_json.encode()
+    else:
+        canonical_event = orjson.dumps(event_data, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(
+        event_type.encode() + b"|" + canonical_event,
+        digest_size=16
+    ).digest()
+
+
+def is_valid_tool_call(llm_response_str):
+    """True when an LLM response is a JSON call to a known tool with well-typed arguments."""
+    try:
+        _TOOL_CALL_DECODER.decode(llm_response_str)
+    except msgspec.DecodeError:
+        return False
+    return True
+
+
+def prompt_json(value):
+    """Serializes structured data for a prompt with sorted keys, so equal values give equal bytes."""
+    return orjson.dumps(value, option=orjson.OPT_SORT_KEYS).decode()
+
+
+def build_event_message(event_type, compact_event_json, order_id, user_id):
+    """Builds the per-incident message that follows SYSTEM_MSG on every turn."""
+    return {
+        'role': 'user',
+        'content': EVENT_PROMPT_TEMPLATE.format(
+            event_type=event_type,
+            event=compact_event_json,
+            order_id=order_id,
+            user_id=user_id
+        )
+    }
+
+
+def canonicalize_event(event_type, event_data):
+    """Strips ids and timestamps from an event so structurally similar incidents embed alike."""
+    def strip(value):
+        if isinstance(value, dict):
+            return {k: strip(v) for k, v in value.items() if not VOLATILE_EVENT_FIELD.search(k)}
+        if isinstance(value, list):
+            return [strip(v) for v in value]
+        return value
+    return f"{event_type}|{orjson.dumps(strip(event_data), option=orjson.OPT_SORT_KEYS).decode()}"
+
+
+def templatize_summary(summary, ids):
+    """Replaces this incident's ids in a summary with placeholders so it can be reused.
+
+    Only ids in a known context ("order 1001", "user 7", "SIM1001") are replaced. Returns None if the
+    summary is unsafe to reuse: an id value is left over as an ordinary number ("1 method"), or an id
+    context holds a number that is not this incident's id.
+    """
+    for name, value in ids.items():
+        if value is not None:
+            summary = re.sub(
+                rf"({ID_CONTEXTS[name]}){re.escape(str(value))}(?!\d)", rf"\g<1><<{name}>>",
+                summary, flags=re.IGNORECASE
+            )
+    for name, value in ids.items():
+        if value is not None and re.search(rf"(?<!\d){re.escape(str(value))}(?!\d)", summary):
+            return None
+    if any(re.search(rf"{context}\d", summary, re.IGNORECASE) for context in ID_CONTEXTS.values()):
+        return None
+    return summary
+
+
+def fill_summary(template, ids):
+    """Fills a templatized summary with another incident's ids, or returns None if one is missing."""
+    for name, value in ids.items():
+        placeholder = f"<<{name}>>"
+        if placeholder in template:
+            if value is None:
+                return None
+            template = template.replace(placeholder, str(value))
+    return template
+
+
+def has_no_active_payment_methods(tool_result):
+    """True when get_payment_methods succeeded but returned no 'active' method."""
+    if "error" in tool_result:
+        return False
+    return not any(m.get('status') == 'active' for m in tool_result.get('payment_methods', []))
+
+
+# --- Deterministic Plans ---
+# Decisions that never need the LLM: tool name -> rules checked in order against that tool's
+# result. A matching rule looks up its policy, escalates and returns a templated summary.
+_DETERMINISTIC_PLANS = {
+    "get_payment_methods": [
+        {
+            "name": "no_active_methods",
+            "applies": has_no_active_payment_methods,
+            "kb_query": "policy for no active backup methods",
+            "escalation_reason": "No active backup payment method for user {user_id} (policy {policy_id})",
+            "summary": (
+                "Payment for order {order_id} could not be retried because user {user_id} has no active "
+                "backup payment method. Escalated to a human agent per policy {policy_id} (ticket {ticket_id})."
+            ),
+        },
+    ],
+}
+
+
+def match_deterministic_plan(tool_name, tool_result):
+    """Returns the first deterministic plan whose rule matches this tool result, if any."""
+    for plan in _DETERMINISTIC_PLANS.get(tool_name, []):
+        if plan["applies"](tool_result):
+            return plan
+    return None
+
+
+class JsonObjectTracker:
+    """Scans streamed text incrementally and reports when the first top-level JSON object closes."""
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, text):
+        """Consumes the next chunk; True once the outermost object's closing brace has been seen."""
+        for ch in text:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == '\\':
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch == '{':
+                self.depth += 1
+            elif ch == '}' and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    return True
+        return False
+
+
+async def _resume_stream(first_chunk, stream):
+    """Yields a chunk already pulled from a streaming chat, then the rest of that stream."""
+    try:
+        if first_chunk is not None:
+            yield first_chunk
+        async for chunk in stream:
+            yield chunk
+    finally:
+        await stream.aclose()
+
+
+class BatchingOllamaClient:
+    """Coalesces chat calls from concurrent incidents and hands them to Ollama together.
+
+    Calls arriving within OLLAMA_BATCH_WAIT_MS are grouped (up to OLLAMA_MAX_BATCH) and issued
+    concurrently, so the Ollama scheduler (OLLAMA_NUM_PARALLEL) can decode them as one batch
+    instead of seeing a trickle of independent requests. A full batch is flushed without waiting
+    out the window, and each call is answered as soon as it completes, never waiting on the rest
+    of its batch. A streaming chat only sends its request once iterated, so the batch pulls each
+    stream's first chunk itself before handing it back.
+    """
+
+    def __init__(self, client, max_batch=OLLAMA_MAX_BATCH, max_wait_ms=OLLAMA_BATCH_WAIT_MS):
+        self._client = client
+        self._max_batch = max_batch
+        self._max_wait = max_wait_ms / 1000
+        self._queue = asyncio.Queue()
+        self._dispatcher = None
+        self._batch_tasks = set() # asyncio keeps only weak references to running tasks
+
+    async def chat(self, **kwargs):
+        """Queues one ollama chat() call and returns its response once its batch has run."""
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((kwargs, future))
+        return await future
+
+    async def close(self):
+        if self._dispatcher:
+            self._dispatcher.cancel()
+
+    async def _dispatch(self):
+        while True:
+            batch = [await self._queue.get()]
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self._max_wait
+            while len(batch) < self._max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            log.info(f"Dispatching Ollama batch of {len(batch)} chat call(s).")
+            self._run_batch(batch)
+
+    async def _send(self, kwargs, future):
+        """Issues one chat call and resolves its caller's future as soon as that call completes."""
+        try:
+            response = await self._client.chat(**kwargs)
+            if kwargs.get('stream'):
+                first_chunk = await anext(response, None) # Sends the HTTP request
+                if future.cancelled(): # Nobody will iterate it; stop Ollama decoding the rest
+                    await response.aclose()
+                    return
+                response = _resume_stream(first_chunk, response)
+        except Exception as e:
+            if not future.cancelled():
+                future.set_exception(e)
+            return
+        if not future.cancelled():
+            future.set_result(response)
+
+    def _run_batch(self, batch):
+        # One task per call: the batch is sent together, but each caller is answered on its own
+        # completion rather than waiting for the slowest generation in the batch
+        for kwargs, future in batch:
+            task = asyncio.create_task(self._send(kwargs, future))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+            future.add_done_callback(lambda f, task=task: task.cancel() if f.cancelled() else None)
+
+
 class AgentService(agent_pb2_grpc.AgentServiceServicer):
     """Implements the gRPC AgentService."""
 
     def __init__(self):
         self.ollama_client = None
-        self.es_client = None
-        self.connect_to_ollama()
-        self.connect_to_elasticsearch()
-
-    def connect_to_ollama(self):
+        self.batcher = None
+        self.es_client = None # Set only once Elasticsearch is reachable
+        self.es_ready = asyncio.Event() # Set once es_client is connected and the search template stored
+        self._es_connect_task = None
+        self._preload_task = None
+        # Shared keep-alive pool for all payment tool calls. Transport retries only cover
+        # failed connection attempts, so a non-idempotent retry_payment is never sent twice.
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=32),
+            timeout=httpx.Timeout(10.0, connect=2.0),
+            transport=httpx.AsyncHTTPTransport(retries=2)
+        )
+        # Exact-match cache of final summaries. All incidents run on one event loop and the
+        # caches are never touched across an await, so they need no locking.
+        self._response_cache = cachetools.LRUCache(maxsize=RESPONSE_CACHE_SIZE)
+        # Semantic cache: ring buffer of unit-norm event embeddings (one row per entry) with parallel
+        # summary templates; rows [0, _sem_count) are live, _sem_next is overwritten next
+        self._sem_vectors = None # (SEMANTIC_CACHE_SIZE, dim) float32, allocated on first store
+        self._sem_summaries = [None] * SEMANTIC_CACHE_SIZE
+        self._sem_count = 0
+        self._sem_next = 0
+        # Short-lived knowledge base answers, so an incident storm does not repeat identical searches
+        self._policy_cache = cachetools.TTLCache(maxsize=256, ttl=POLICY_CACHE_TTL)
+        self.inflight_incidents = 0
+        self.semantic_cache_enabled = SEMANTIC_CACHE_ENABLED # Turned off at startup if EMBED_MODEL is missing
+        self.draft_model = DRAFT_MODEL # Cleared at startup if it is not pulled on the Ollama host
+        self._tool_slots = asyncio.Semaphore(MAX_CONCURRENT_TOOL_CALLS) # Protects downstream services
+
+    async def start(self):
+        """Connects to the backing services. Must be awaited before serving requests.
+
+        Elasticsearch is probed and the models are preloaded in the background so the gRPC port
+        opens immediately; knowledge base lookups report "not ready" until the probe succeeds.
+        """
+        await self.connect_to_ollama()
+        self._es_connect_task = asyncio.create_task(self.connect_to_elasticsearch())
+
+    async def close(self):
+        """Releases pooled connections on shutdown."""
+        for task in (self._es_connect_task, self._preload_task):
+            if task and not task.done():
+                task.cancel()
+        await self._http.aclose()
+        if self.batcher:
+            await self.batcher.close()
+        if self.es_client:
+            await self.es_client.close()
+
+    async def connect_to_ollama(self):
         # ... (same as before) ...
         try:
             log.info(f"Connecting to Ollama at {OLLAMA_HOST}...")
-            self.ollama_client = ollama.Client(host=OLLAMA_HOST)
-            self.ollama_client.list() # Check connection
+            self.ollama_client = ollama.AsyncClient(host=OLLAMA_HOST)
+            available = await self.ollama_client.list() # Check connection
+            available_models = {m['model'] for m in available['models']}
+            preload = []
+            for model in filter(None, (MODEL_NAME, self.draft_model)):
+                wanted = model if ':' in model else f"{model}:latest"
+                if wanted not in available_models:
+                    log.error(f"Model '{model}' is not available on the Ollama host; run `ollama pull {model}`. Available: {sorted(available_models)}")
+                    if model == self.draft_model:
+                        log.error("Draft model missing; tool calls will be planned with the main model only.")
+                        self.draft_model = None
+                else:
+                    preload.append(model)
+            if self.semantic_cache_enabled:
+                wanted = EMBED_MODEL if ':' in EMBED_MODEL else f"{EMBED_MODEL}:latest"
+                if wanted not in available_models:
+                    log.error(f"Embedding model '{EMBED_MODEL}' is not available on the Ollama host; run `ollama pull {EMBED_MODEL}`. Semantic cache disabled.")
+                    self.semantic_cache_enabled = False
+            # Loading weights can take minutes on a cold host; warm up in the background so the
+            # gRPC port opens as soon as Ollama answers list()
+            self._preload_task = asyncio.create_task(self.preload_models(preload))
+            self.batcher = BatchingOllamaClient(self.ollama_client)
             log.info("Ollama client initialized and ready.")
         except Exception as e:
             log.error(f"Failed to connect to Ollama: {e}")
             self.ollama_client = None
 
 
-    def connect_to_elasticsearch(self):
-        """Connects to the Elasticsearch service with retries."""
+    async def preload_models(self, models):
+        """Preloads the chat models (and the embedding model, if the semantic cache is on) concurrently."""
+        await asyncio.gather(
+            *(self.preload_model(model) for model in models),
+            *([self.preload_model(EMBED_MODEL, embedding=True)] if self.semantic_cache_enabled else [])
+        )
+
+    async def preload_model(self, model, embedding=False):
+        """Loads a model into Ollama's memory ahead of the first incident and pins it there."""
+        try:
+            # An empty prompt only loads the weights; no tokens are generated
+            if embedding: # Embedding-only models do not support generate()
+                await self.ollama_client.embed(model=model, input='', keep_alive=MODEL_KEEP_ALIVE)
+            else:
+                await self.ollama_client.generate(model=model, prompt='', keep_alive=MODEL_KEEP_ALIVE)
+            log.info(f"Preloaded model '{model}'.")
+        except Exception as e:
+            log.warning(f"Could not preload model '{model}' ({e}); it will load on first use.")
+
+
+    async def connect_to_elasticsearch(self):
+        """Connects to the Elasticsearch service, retrying until it is reachable.
+
+        Runs in the background (see start()), so it never gives up: on a cold start Elasticsearch
+        can take well over a minute to boot, and the agent serves without RAG until then.
+        """
         log.info(f"Attempting to connect to Elasticsearch at {ELASTICSEARCH_HOST}...")
         # Use the service name defined in docker-compose
-        self.es_client = Elasticsearch(
+        es_client = AsyncElasticsearch(
             ELASTICSEARCH_HOST,
-            request_timeout=10 # Add a timeout
+            request_timeout=10, # Add a timeout
+            http_compress=True, # gzip request/response bodies (policy documents compress well)
+            connections_per_node=ES_CONNECTIONS_PER_NODE,
+            max_retries=2,
+            retry_on_timeout=True,
+            sniff_on_start=False # Single node; pass a host list and enable sniffing for a cluster
         )
-        retries = 5
-        while retries > 0:
+        attempt = 0
+        try:
+            while True:
+                try:
+                    # Use client.info() which is more reliable than ping() across versions
+                    if await es_client.info():
+                        await es_client.put_script(
+                            id=POLICY_SEARCH_TEMPLATE_ID,
+                            script={"lang": "mustache", "source": POLICY_SEARCH_TEMPLATE}
+                        )
+                        self.es_client = es_client
+                        self.es_ready.set()
+                        log.info("Successfully connected to Elasticsearch.")
+                        return # Success
+                    else:
+                         log.warning("Elasticsearch info() returned False, retrying...")
+                except exceptions.ConnectionTimeout as e:
+                     log.warning(f"Elasticsearch connection timed out ({e}), retrying...")
+                except exceptions.ConnectionError as e:
+                    log.warning(f"Elasticsearch connection error ({type(e).__name__}), retrying...")
+                except Exception as e:
+                    log.warning(f"Unexpected error connecting to Elasticsearch ({type(e).__name__}), retrying...")
+
+                await asyncio.sleep(min(8, 0.5 * (2 ** attempt))) # Exponential backoff: 0.5, 1, 2, 4, then every 8s
+                attempt += 1
+        except asyncio.CancelledError: # Shutdown before Elasticsearch came up
+            await es_client.close()
+            raise
+
+
+    # --- Semantic Cache ---
+    async def embed_event(self, canonical_event):
+        """Returns the unit-normalized embedding of a canonicalized event, or None on failure."""
+        try:
+            response = await self.ollama_client.embed(model=EMBED_MODEL, input=canonical_event, keep_alive=MODEL_KEEP_ALIVE)
+            vector = np.asarray(response['embeddings'][0], dtype=np.float32)
+        except Exception as e:
+            log.warning(f"Could not embed event for semantic cache: {e}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def semantic_cache_lookup(self, vector):
+        """Returns the cached summary template most similar to vector above the threshold, if any."""
+        if not self._sem_count or self._sem_vectors.shape[1] != vector.shape[0]:
+            return None
+        similarities = self._sem_vectors[:self._sem_count] @ vector
+        best = int(np.argmax(similarities))
+        if similarities[best] <= SEMANTIC_CACHE_THRESHOLD:
+            return None
+        log.info(f"Semantic cache hit (similarity {similarities[best]:.3f}).")
+        return self._sem_summaries[best]
+
+    def semantic_cache_store(self, vector, summary_template):
+        """Adds an embedding/summary pair in place, overwriting the oldest entry when full."""
+        if self._sem_vectors is None or self._sem_vectors.shape[1] != vector.shape[0]:
+            # First entry, or the embedding model changed dimensions
+            self._sem_vectors = np.zeros((SEMANTIC_CACHE_SIZE, vector.shape[0]), dtype=np.float32)
+            self._sem_summaries = [None] * SEMANTIC_CACHE_SIZE
+            self._sem_count = 0
+            self._sem_next = 0
+        self._sem_vectors[self._sem_next] = vector
+        self._sem_summaries[self._sem_next] = summary_template
+        self._sem_next = (self._sem_next + 1) % SEMANTIC_CACHE_SIZE
+        self._sem_count = min(self._sem_count + 1, SEMANTIC_CACHE_SIZE)
+
+
+    # --- LLM Calls ---
+    async def stream_tool_call(self, **chat_args):
+        """Streams a JSON-mode chat and stops generation once a complete tool call has arrived."""
+        stream = await self.batcher.chat(stream=True, **chat_args)
+        buffer = ""
+        tracker = JsonObjectTracker() # Only scans each new chunk, instead of re-parsing the whole buffer
+        try:
+            async for chunk in stream:
+                content = chunk['message']['content']
+                buffer += content
+                if tracker.feed(content):
+                    break # Anything generated after the closing brace is not needed
+        finally:
+            await stream.aclose() # Drops the HTTP stream, which cancels generation in Ollama
+        return buffer
+
+
+    async def plan_tool_call(self, **chat_args):
+        """Drafts a tool call with the draft model and falls back to MODEL_NAME if the draft is invalid."""
+        if self.draft_model:
             try:
-                # Use client.info() which is more reliable than ping() across versions
-                if self.es_client.info():
-                    log.info("Successfully connected to Elasticsearch.")
-                    return # Success
-                else:
-                     log.warning("Elasticsearch info() returned False, retrying...")
-            except exceptions.ConnectionTimeout as e:
-                 log.warning(f"Elasticsearch connection timed out ({e}), retrying...")
-            except exceptions.ConnectionError as e:
-                log.warning(f"Elasticsearch connection error ({type(e).__name__}), retrying...")
+                draft = (await self.stream_tool_call(model=self.draft_model, **chat_args)).strip()
+                if is_valid_tool_call(draft):
+                    return draft
+                log.info(f"Draft model returned an invalid tool call, retrying with {MODEL_NAME}: {draft}")
             except Exception as e:
-                log.warning(f"Unexpected error connecting to Elasticsearch ({type(e).__name__}), retrying...")
-
-            retries -= 1
-            time.sleep(5) # Wait 5 seconds before retrying
-
-        log.error("Failed to connect to Elasticsearch after several retries. RAG will not function.")
-        self.es_client = None # Ensure client is None if connection failed
+                log.warning(f"Draft model {self.draft_model} failed ({e}), retrying with {MODEL_NAME}.")
+        return (await self.stream_tool_call(model=MODEL_NAME, **chat_args)).strip()
 
 
     # --- Tool Calling Functions ---
-    def call_payment_tool(self, tool_name, tool_args):
+    async def call_payment_tool(self, tool_name, tool_args):
         # ... (same as before, handles get_payment_methods and retry_payment) ...
         api_endpoint = ""
         if tool_name == "get_payment_methods":
@@ -138,38 +669,47 @@ class AgentService(agent_pb2_grpc.AgentServiceServicer):
              log.warning(f"Attempted to call unknown payment tool: {tool_name}")
              return {"error": f"Tool '{tool_name}' not recognized by payment tool caller."}
         try:
-            response = requests.post(api_endpoint, json=tool_args)
+            response = await self._http.post(api_endpoint, json=tool_args)
             response.raise_for_status()
             tool_result = response.json()
             log.info(f"Payment Tool Response: {tool_result}")
             return tool_result
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             log.error(f"Error calling Payment Tool ({tool_name}): {e}")
             return {"error": f"Failed to call tool {tool_name}: {e}"}
 
 
-    def call_knowledge_base(self, query):
+    async def call_knowledge_base(self, query):
         # ... (same as before) ...
-        if not self.es_client:
-            log.error("Cannot query knowledge base: Elasticsearch client not connected.")
-            return {"error": "Knowledge base (Elasticsearch) is unavailable."}
+        if not self.es_ready.is_set():
+            log.warning("Cannot query knowledge base: Elasticsearch connection not ready yet.")
+            return {"error": "Knowledge base (Elasticsearch) is not ready yet."}
+
+        cached_result = self._policy_cache.get(query)
+        if cached_result is not None:
+            log.info(f"Knowledge base cache hit for: '{query}'")
+            return cached_result
 
         log.info(f"Querying Knowledge Base (Elasticsearch) for: '{query}'")
         try:
-            response = self.es_client.search(
+            response = await self.es_client.search_template(
                 index=ELASTICSEARCH_INDEX,
-                query={"match": {"content": query}}
+                id=POLICY_SEARCH_TEMPLATE_ID,
+                params={"query": query},
+                preference="_local"
             )
             hits = response['hits']['hits']
             if hits:
                 best_hit_content = hits[0]['_source']['content']
                 log.info(f"Found relevant policy: {hits[0]['_source']['policy_id']}")
                 # Return slightly more structured data
-                return {"policy_found": True, "policy_id": hits[0]['_source']['policy_id'], "policy_content": best_hit_content}
+                tool_result = {"policy_found": True, "policy_id": hits[0]['_source']['policy_id'], "policy_content": best_hit_content}
             else:
                 log.info("No relevant policies found in knowledge base.")
-                return {"policy_found": False, "policy_content": "No relevant policy found."}
-        except exceptions.ElasticsearchException as e:
+                tool_result = {"policy_found": False, "policy_content": "No relevant policy found."}
+            self._policy_cache[query] = tool_result
+            return tool_result
+        except (exceptions.ApiError, exceptions.TransportError) as e:
             log.error(f"Error querying Elasticsearch: {e}")
             return {"error": f"Error querying knowledge base: {e}"}
         except Exception as e:
@@ -177,16 +717,89 @@ class AgentService(agent_pb2_grpc.AgentServiceServicer):
              return {"error": f"Unexpected error querying knowledge base: {e}"}
 
 
+    async def use_speculative_policy(self, speculative_policy, query):
+        """Returns the prefetched policy lookup, querying again if it does not arrive in time."""
+        try:
+            tool_result = await asyncio.wait_for(asyncio.shield(speculative_policy), SPECULATIVE_POLICY_TIMEOUT)
+            log.info("Using speculatively prefetched knowledge base result.")
+            return tool_result
+        except asyncio.TimeoutError:
+            log.warning("Speculative knowledge base query timed out, querying again.")
+            return await self.call_knowledge_base(query)
+
+
+    async def execute_tool_call(self, tool_call, event_ids, speculative_policy):
+        """Runs one decoded tool call, filling ids the LLM left out from the event, and returns its result."""
+        tool_name = tool_call.__struct_config__.tag
+        tool_args = tool_call.tool_args
+        async with self._tool_slots:
+            log.info(f"Executing tool call: {tool_name} with args: {tool_args}")
+            if isinstance(tool_call, GetPaymentMethodsCall):
+                if tool_args.user_id is None: tool_args.user_id = event_ids["user_id"]
+                return await self.call_payment_tool(tool_name, msgspec.structs.asdict(tool_args))
+            if isinstance(tool_call, RetryPaymentCall):
+                if tool_args.order_id is None: tool_args.order_id = event_ids["order_id"]
+                return await self.call_payment_tool(tool_name, msgspec.structs.asdict(tool_args))
+            if isinstance(tool_call, QueryKnowledgeBaseCall):
+                # call_knowledge_base reports "not ready yet" itself
+                if speculative_policy and SPECULATIVE_POLICY_QUERY in tool_args.query.lower():
+                    return await self.use_speculative_policy(speculative_policy, tool_args.query)
+                return await self.call_knowledge_base(tool_args.query)
+            # EscalateToHumanCall; its result is summarized in the next turn
+            if tool_args.order_id is None: tool_args.order_id = event_ids["order_id"]
+            return self.call_escalate_to_human(tool_args.order_id, tool_args.reason)
+
+
+    async def run_deterministic_plan(self, plan, order_id, user_id):
+        """Executes a rule from _DETERMINISTIC_PLANS and returns its final summary."""
+        log.info(f"Deterministic plan '{plan['name']}' matched, skipping LLM turns.")
+        policy_result = await self.call_knowledge_base(plan["kb_query"])
+        policy_id = policy_result.get("policy_id", "unavailable")
+        reason = plan["escalation_reason"].format(user_id=user_id, policy_id=policy_id)
+        escalation_result = self.call_escalate_to_human(order_id, reason)
+        return plan["summary"].format(
+            order_id=order_id,
+            user_id=user_id,
+            policy_id=policy_id,
+            ticket_id=escalation_result["ticket_id"]
+        )
+
+
     def call_escalate_to_human(self, order_id, reason):
         # ... (same as before) ...
         log.warn(f"ESCALATION TRIGGERED for order {order_id}. Reason: {reason}. Ticket #SIM{order_id} created.")
         return {"ticket_id": f"SIM{order_id}", "status": "Escalation ticket created successfully."}
 
 
-    def HandleIncident(self, request, context):
+    async def HandleIncident(self, request, context):
         """Handles the incoming gRPC request (multi-turn with RAG)."""
+        self.inflight_incidents += 1
+        try:
+            return await self.handle_incident(request)
+        finally:
+            self.inflight_incidents -= 1
+
+    async def handle_incident(self, request):
+        """Runs the agent loop for one incident and builds the gRPC response."""
         log.info(f"Received incident: {request.event_type} - {request.full_event_json}")
         final_summary = "Agent processing completed with errors." # Default
+        resolved = False # Only summaries produced by the agent are cached
+
+        # --- Parse Event (once; reused for the cache key, ids and prompt) ---
+        event_data = None
+        # Parsed inline: orjson holds the GIL for the whole parse, so a thread pool would not free the
+        # loop, and shipping the string to a process pool costs about as much as parsing it here
+        try:
+            event_data = orjson.loads(request.full_event_json)
+        except orjson.JSONDecodeError:
+            log.warning("Could not parse event JSON.")
+
+        # --- Response Cache ---
+        cache_key = response_cache_key(request.event_type, event_data, request.full_event_json)
+        cached_summary = self._response_cache.get(cache_key)
+        if cached_summary is not None:
+            log.info("Response cache hit, returning cached summary.")
+            return agent_pb2.IncidentResponse(status="COMPLETED", agent_response=cached_summary)
 
         # --- Connection Checks ---
         if not self.ollama_client:
@@ -195,17 +808,36 @@ class AgentService(agent_pb2_grpc.AgentServiceServicer):
             return agent_pb2.IncidentResponse(status="ERROR", agent_response=error_msg)
         # We will handle RAG call failure later if es_client is None
 
+        speculative_policy = None
         try:
             # --- Setup ---
-            conversation_history = []
-            try:
-                 event_data = json.loads(request.full_event_json)
-                 user_id_from_event = event_data.get('user_id')
-                 order_id_from_event = event_data.get('order_id')
-            except json.JSONDecodeError:
-                 user_id_from_event = None
-                 order_id_from_event = None
-                 log.warning("Could not parse event JSON for IDs.")
+            user_id_from_event = None
+            order_id_from_event = None
+            if isinstance(event_data, dict):
+                user_id_from_event = event_data.get('user_id')
+                order_id_from_event = event_data.get('order_id')
+            event_ids = {"order_id": order_id_from_event, "user_id": user_id_from_event}
+
+            # --- Semantic Cache (near-duplicate incidents) ---
+            event_vector = None
+            if self.semantic_cache_enabled and isinstance(event_data, dict):
+                event_vector = await self.embed_event(canonicalize_event(request.event_type, event_data))
+            if event_vector is not None:
+                cached_template = self.semantic_cache_lookup(event_vector)
+                cached_summary = fill_summary(cached_template, event_ids) if cached_template else None
+                if cached_summary is not None:
+                    return agent_pb2.IncidentResponse(status="COMPLETED", agent_response=cached_summary)
+
+            # Overlap the most common policy lookup with the LLM turns; discarded if never planned
+            if self.es_ready.is_set():
+                speculative_policy = asyncio.create_task(self.call_knowledge_base(SPECULATIVE_POLICY_QUERY))
+
+            # Stable prefix: SYSTEM_MSG (shared by all incidents) then the event (shared by this incident's
+            # turns). Turns are stateless: each appends only its prompt, which carries the last tool result.
+            # Reuse the parse from above to send the event without pretty-print whitespace.
+            compact_event_json = prompt_json(event_data) if event_data is not None else request.full_event_json
+            event_message = build_event_message(request.event_type, compact_event_json, order_id_from_event, user_id_from_event)
+            last_tool_result = None
 
             current_turn = 1
             max_turns = 5
@@ -231,144 +863,90 @@ class AgentService(agent_pb2_grpc.AgentServiceServicer):
                 # --- Construct Prompt Based on Turn and PREVIOUSLY PLANNED tool ---
                 # Turn 1: Always get payment methods first
                 if current_turn == 1:
-                    prompt = f"""
-                    You are 'Aegis', resolving a '{request.event_type}' incident for order_id {order_id_from_event}, user_id {user_id_from_event}.
-                    Event Details: {request.full_event_json}
-                    Available tools: {json.dumps(AVAILABLE_TOOLS, indent=2)}
-                    Goal: Resolve this payment failure.
-                    Your *very first step* MUST be to call 'get_payment_methods'.
-                    Respond ONLY with a valid JSON object containing exactly two keys: "tool_name" (string) and "tool_args" (object).
-                    The value for "tool_name" must be "get_payment_methods".
-                    The value for "tool_args" must be an object containing the key "user_id" with the value {user_id_from_event}.
-                    DO NOT include descriptions, parameters, or any other keys in your JSON response.
-                    """
-                # Turn 2: Should follow 'get_payment_methods'
-                elif last_tool_name_planned_in_prev_turn == "get_payment_methods":
-                    last_tool_result = conversation_history[-1]['content'] if len(conversation_history) > 0 and conversation_history[-1]['role'] == 'tool' else '{"error": "Could not get previous tool result"}'
-                    prompt = f"""
-                    Result of 'get_payment_methods': {last_tool_result}
-                    Available tools: {json.dumps(AVAILABLE_TOOLS, indent=2)}
-                    Analyze the result.
-                    - If you see an 'active' payment method, your next step MUST be to call 'retry_payment'. Respond ONLY with JSON containing "tool_name": "retry_payment" and "tool_args" object including the correct order_id ({order_id_from_event}) and the active payment_method_id.
-                    - If there are NO 'active' methods, your next step MUST be to call 'query_knowledge_base' about the policy for 'no active backup methods'. Respond ONLY with JSON containing "tool_name": "query_knowledge_base" and "tool_args" object with the query.
-                    """
-                # Turn 3: Should follow 'retry_payment'
-                elif last_tool_name_planned_in_prev_turn == "retry_payment":
-                    last_tool_result = conversation_history[-1]['content'] if len(conversation_history) > 0 and conversation_history[-1]['role'] == 'tool' else '{"error": "Could not get previous tool result"}'
-                    prompt = f"""
-                    Result of 'retry_payment': {last_tool_result}
-                    Available tools: {json.dumps(AVAILABLE_TOOLS, indent=2)}
-                    Analyze the result.
-                    - If the status is 'success', provide ONLY the final summary text (NO JSON).
-                    - If the status is 'failed', your next step MUST be to call 'query_knowledge_base' about the policy for 'multiple payment failures'. Respond ONLY with JSON containing "tool_name": "query_knowledge_base" and "tool_args" object with the query.
-                    """
-                # Turn 4: Should follow 'query_knowledge_base'
-                elif last_tool_name_planned_in_prev_turn == "query_knowledge_base":
-                     last_tool_result = conversation_history[-1]['content'] if len(conversation_history) > 0 and conversation_history[-1]['role'] == 'tool' else '{"error": "Could not get previous tool result"}'
-                     prompt = f"""
-                     Result of 'query_knowledge_base': {last_tool_result}
-                     Available tools: {json.dumps(AVAILABLE_TOOLS, indent=2)}
-                     Analyze the policy content found. Your next step MUST be to call the 'escalate_to_human' tool.
-                     Respond ONLY with JSON containing "tool_name": "escalate_to_human" and "tool_args" object including the order_id ({order_id_from_event}) and a brief reason based on the policy.
-                     """
-                # Turn 5: Should follow 'escalate_to_human' (final summary)
-                elif last_tool_name_planned_in_prev_turn == "escalate_to_human":
-                     last_tool_result = conversation_history[-1]['content'] if len(conversation_history) > 0 and conversation_history[-1]['role'] == 'tool' else '{"error": "Could not get previous tool result"}'
-                     prompt = f"""
-                     Result of 'escalate_to_human': {last_tool_result}
-                     Provide ONLY the final, concise summary message based on the escalation result (NO JSON).
-                     """
+                    prompt = TURN1_TEMPLATE.format(user_id=user_id_from_event)
+                # Turns 2-5: Follow up on the tool planned in the previous turn
+                elif last_tool_name_planned_in_prev_turn in FOLLOW_UP_TEMPLATES:
+                    prompt = FOLLOW_UP_TEMPLATES[last_tool_name_planned_in_prev_turn].format(
+                        result=last_tool_result or MISSING_TOOL_RESULT,
+                        order_id=order_id_from_event
+                    )
                 else:
-                    log.error(f"Agent reached unexpected state at Turn {current_turn}. Last tool planned: {last_tool_name_planned_in_prev_turn}. History: {conversation_history}")
+                    log.error(f"Agent reached unexpected state at Turn {current_turn}. Last tool planned: {last_tool_name_planned_in_prev_turn}. Last tool result: {last_tool_result}")
                     final_summary = "Agent reached an unexpected state."
                     break # Exit loop
 
-                conversation_history.append({'role': 'user', 'content': prompt})
+                messages = [SYSTEM_MSG, event_message, {'role': 'user', 'content': prompt}]
 
                 # --- Call LLM ---
-                log.info(f"Sending prompt to Llama 3 (Turn {current_turn}). Expect JSON: {expect_json}")
-                llm_format = 'json' if expect_json is True else None
-                try:
-                    response = self.ollama_client.chat(
-                        model='llama3',
-                        messages=conversation_history,
-                        format=llm_format
-                    )
-                    llm_response_str = response['message']['content'].strip()
-                except Exception as llm_error:
-                    log.error(f"Error calling Ollama: {llm_error}")
-                    final_summary = f"Error communicating with LLM: {llm_error}"
-                    break # Exit loop on LLM error
-
-                log.info(f"LLM (Llama 3) Turn {current_turn} Response: {llm_response_str}")
-                conversation_history.append({'role': 'assistant', 'content': llm_response_str})
+                if current_turn == 1 and user_id_from_event is not None:
+                    # TURN1_TEMPLATE fully dictates this call, so it is made without an LLM round trip
+                    llm_response_str = orjson.dumps(
+                        {"tool_name": "get_payment_methods", "tool_args": {"user_id": user_id_from_event}}
+                    ).decode()
+                else:
+                    log.info(f"Sending prompt to LLM (Turn {current_turn}). Expect JSON: {expect_json}")
+                    llm_format = 'json' if expect_json is True else None
+                    try:
+                        chat_args = dict(
+                            messages=messages,
+                            format=llm_format,
+                            options=PLANNER_OPTIONS if expect_json is True else SUMMARY_OPTIONS,
+                            keep_alive=MODEL_KEEP_ALIVE
+                        )
+                        if expect_json is True:
+                            llm_response_str = await self.plan_tool_call(**chat_args)
+                        else:
+                            response = await self.batcher.chat(model=MODEL_NAME, **chat_args)
+                            llm_response_str = response['message']['content'].strip()
+                    except Exception as llm_error:
+                        log.error(f"Error calling Ollama: {llm_error}")
+                        final_summary = f"Error communicating with LLM: {llm_error}"
+                        break # Exit loop on LLM error
+
+                log.info(f"LLM Turn {current_turn} Response: {llm_response_str}")
 
                 # --- Process LLM Response ---
                 # Reset planned tool for the next iteration before processing
                 last_tool_name_planned_in_prev_turn = None
                 tool_executed_this_turn = False
                 try:
-                    # Always TRY to parse as JSON first, even if expect_json is None or False
-                    llm_decision = json.loads(llm_response_str)
-                    tool_name = llm_decision.get("tool_name")
-                    tool_args = llm_decision.get("tool_args")
-
-                    # Check if it LOOKS like a valid tool call structure
-                    if tool_name and isinstance(tool_args, dict):
-                         # --- **REVISED LOGIC: If it looks like a tool call, execute it.** ---
-                         log.info(f"LLM response parsed as JSON tool call for '{tool_name}'.")
-                         last_tool_name_planned_in_prev_turn = tool_name # Record for next turn
-
-                         # --- Execute Tool ---
-                         log.info(f"Executing tool call: {tool_name} with args: {tool_args}")
-                         tool_result = {}
-                         # (Argument handling needs refinement)
-                         if tool_name == "get_payment_methods":
-                             if 'user_id' not in tool_args and user_id_from_event: tool_args['user_id'] = user_id_from_event
-                             tool_result = self.call_payment_tool(tool_name, tool_args)
-                         elif tool_name == "retry_payment":
-                             if 'order_id' not in tool_args and order_id_from_event: tool_args['order_id'] = order_id_from_event
-                             tool_result = self.call_payment_tool(tool_name, tool_args)
-                         elif tool_name == "query_knowledge_base":
-                              if not self.es_client:
-                                   tool_result = {"error": "Knowledge base (Elasticsearch) is unavailable."}
-                                   log.error(tool_result["error"])
-                              else:
-                                  tool_result = self.call_knowledge_base(tool_args.get('query', ''))
-                         elif tool_name == "escalate_to_human":
-                             if 'order_id' not in tool_args and order_id_from_event: tool_args['order_id'] = order_id_from_event
-                             tool_result = self.call_escalate_to_human(tool_args.get('order_id'), tool_args.get('reason', 'Reason not specified'))
-                             # Escalation result needs to be summarized in the next turn
-                         else:
-                             tool_result = {"error": f"Tool '{tool_name}' execution not implemented."}
-                             log.warning(tool_result["error"])
-
-                         # Add tool result to history
-                         tool_result_str = json.dumps(tool_result)
-                         conversation_history.append({'role': 'tool', 'content': tool_result_str})
-                         tool_executed_this_turn = True # Mark that we executed a tool
-
-                    else: # Parsed as JSON, but doesn't look like a tool call
-                        log.info("LLM response was JSON but not a valid tool call format, assuming final summary.")
-                        final_summary = llm_response_str
-                        break # Exit loop
-
-                except json.JSONDecodeError:
-                    # It wasn't JSON. If we expected JSON, it's an error. Otherwise, it's the summary.
+                    # Always TRY to decode as a tool call first, even if expect_json is None or False
+                    tool_call = _TOOL_CALL_DECODER.decode(llm_response_str)
+                    tool_name = tool_call.__struct_config__.tag
+                    log.info(f"LLM response parsed as JSON tool call for '{tool_name}'.")
+                    last_tool_name_planned_in_prev_turn = tool_name # Record for next turn
+
+                    # --- Execute Tool ---
+                    tool_result = await self.execute_tool_call(tool_call, event_ids, speculative_policy)
+                    plan = match_deterministic_plan(tool_name, tool_result)
+                    if plan:
+                        # Report the ids the tool actually ran with; the LLM may have supplied one the event lacked
+                        executed_args = msgspec.structs.asdict(tool_call.tool_args)
+                        final_summary = await self.run_deterministic_plan(
+                            plan,
+                            executed_args.get("order_id", order_id_from_event),
+                            executed_args.get("user_id", user_id_from_event)
+                        )
+                        resolved = True
+                        break # No LLM needed for the remaining turns
+
+                    # Carried into the next turn's prompt
+                    last_tool_result = prompt_json(tool_result)
+                    tool_executed_this_turn = True # Mark that we executed a tool
+
+                except msgspec.DecodeError as e: # Also covers msgspec.ValidationError
+                    # Not JSON, or JSON that is not a well-formed call to a known tool. If we expected
+                    # a tool call, it's an error (and never cached). Otherwise, it's the summary.
                     if expect_json is True:
-                         log.error(f"Expected JSON tool call, but received text: {llm_response_str}")
+                         log.error(f"Expected JSON tool call, but received: {llm_response_str} ({e})")
                          final_summary = "LLM failed to provide expected JSON tool call."
                          break # Exit loop on error
                     else: # Expected text or either (None), so treat as final summary
-                         log.info("LLM response was text as expected or allowed, assuming final summary.")
+                         log.info("LLM response was not a tool call, as expected or allowed; assuming final summary.")
                          final_summary = llm_response_str
+                         resolved = True
                          break # Exit loop
 
-                except ValueError as e: # Catch argument processing errors etc.
-                     log.error(f"Error processing LLM response or tool args: {e}. Raw response: {llm_response_str}")
-                     final_summary = f"Error processing LLM response: {e}"
-                     break # Exit loop on error
-
                 # Check if we should move to the next turn
                 if not tool_executed_this_turn:
                      log.error("Loop reached end without executing a tool or reaching a final summary. Breaking.")
@@ -383,6 +961,11 @@ class AgentService(agent_pb2_grpc.AgentServiceServicer):
                 log.warning(final_summary)
                 return agent_pb2.IncidentResponse(status="ERROR", agent_response=final_summary)
             else: # Loop exited via 'break'
+                if resolved:
+                    self._response_cache[cache_key] = final_summary
+                    summary_template = templatize_summary(final_summary, event_ids) if event_vector is not None else None
+                    if summary_template is not None:
+                        self.semantic_cache_store(event_vector, summary_template)
                 log.info(f"Returning final summary to Java: {final_summary}")
                 return agent_pb2.IncidentResponse(status="COMPLETED", agent_response=final_summary)
 
@@ -390,20 +973,49 @@ class AgentService(agent_pb2_grpc.AgentServiceServicer):
             error_msg = f"Unhandled error in HandleIncident: {e}"
             log.error(error_msg, exc_info=True)
             return agent_pb2.IncidentResponse(status="ERROR", agent_response=error_msg)
+        finally:
+            if speculative_policy and not speculative_policy.done():
+                speculative_policy.cancel()
 
-# ... (Keep the serve() function exactly the same) ...
-def serve():
+
+async def log_inflight_incidents(agent):
+    """Periodically logs how many incidents are being handled concurrently."""
+    while True:
+        await asyncio.sleep(INFLIGHT_LOG_INTERVAL)
+        log.info(f"In-flight incidents: {agent.inflight_incidents}")
+
+
+async def serve():
     """Starts the gRPC server."""
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    agent_pb2_grpc.add_AgentServiceServicer_to_server(AgentService(), server)
+    agent = AgentService()
+    await agent.start()
+    server = grpc.aio.server(
+        options=[
+            ('grpc.so_reuseport', 1),
+            ('grpc.max_concurrent_streams', 100),
+            ('grpc.keepalive_time_ms', 30000),
+            ('grpc.keepalive_timeout_ms', 10000),
+            # Keep the Java client's channel warm between incident bursts instead of reconnecting
+            ('grpc.keepalive_permit_without_calls', 1),
+            ('grpc.http2.max_pings_without_data', 0),
+            ('grpc.http2.min_time_between_pings_ms', 10000),
+            ('grpc.http2.min_ping_interval_without_data_ms', 10000), # Accept client pings at this rate
+        ]
+    )
+    agent_pb2_grpc.add_AgentServiceServicer_to_server(agent, server)
     server.add_insecure_port('[::]:50051')
-    server.start()
-    log.info("Python Agent Host (gRPC) started on port 50051.")
+    await server.start()
+    monitor = asyncio.create_task(log_inflight_incidents(agent))
+    log.info("Python Agent Host (gRPC, asyncio) started on port 50051.")
     try:
-        while True:
-            time.sleep(86400) # One day
-    except KeyboardInterrupt:
-        server.stop(0)
+        await server.wait_for_termination()
+    finally:
+        monitor.cancel()
+        await server.stop(0)
+        await agent.close()
 
 if __name__ == '__main__':
-    serve()
\ No newline at end of file
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
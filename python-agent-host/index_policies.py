@@ -1,37 +1,18 @@
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from elasticsearch import Elasticsearch, exceptions
-import requests # Import requests
+from elasticsearch.helpers import streaming_bulk
 
 # Configuration
 ELASTICSEARCH_HOST_URL = "http://127.0.0.1:9200" # Use IP address
 INDEX_NAME = "aegis_policies"
 POLICY_DIR = "./policies"
-
-# --- NEW: Basic Requests Test ---
-def test_connection_with_requests():
-    print(f"Attempting basic connection to {ELASTICSEARCH_HOST_URL} using requests...")
-    try:
-        response = requests.get(ELASTICSEARCH_HOST_URL, timeout=5) # 5 second timeout
-        response.raise_for_status() # Raise exception for bad status codes
-        print(f"Requests connection successful! Status code: {response.status_code}")
-        # print(f"Response JSON: {response.json()}") # Optionally print the JSON
-        return True
-    except requests.exceptions.Timeout:
-        print("Requests connection timed out.")
-        return False
-    except requests.exceptions.ConnectionError as e:
-        print(f"Requests connection failed: {e}")
-        return False
-    except requests.exceptions.RequestException as e:
-        print(f"Requests encountered an error: {e}")
-        return False
-# --- END NEW ---
+READ_WORKERS = 8 # Threads reading policy files while earlier documents are being uploaded
 
 
 def create_es_client():
     """Creates and waits for Elasticsearch client connection using client.info()."""
-    # Use the same URL as the requests test
     es_client = Elasticsearch(ELASTICSEARCH_HOST_URL)
     retries = 3 # Reduce retries for faster testing
     while retries > 0:
@@ -55,43 +36,69 @@ def create_es_client():
 
 def index_policies(es_client):
     """Reads policy files and indexes them into Elasticsearch."""
-    # (Keep this function exactly as it was before)
     if es_client.indices.exists(index=INDEX_NAME):
         print(f"Index '{INDEX_NAME}' already exists. Skipping indexing.")
         return
 
     print(f"Creating index '{INDEX_NAME}'...")
-    es_client.indices.create(index=INDEX_NAME)
+    # No refreshes or replicas while loading; both are restored once the bulk upload is done
+    es_client.indices.create(index=INDEX_NAME, settings={'refresh_interval': '-1', 'number_of_replicas': 0})
+
+    # DirEntry carries the path and file type, so no extra join/stat per file
+    with os.scandir(POLICY_DIR) as it:
+        entries = [e for e in it if e.is_file() and e.name.endswith(".txt")]
+
+    def read_policy(entry):
+        try:
+            with open(entry.path, 'rb') as f:
+                return entry.name, f.read()
+        except OSError as e:
+            print(f"Error reading file {entry.name}: {e}")
+            return entry.name, None
+
+    def actions(files):
+        doc_id_counter = 1
+        for filename, content in files:
+            if content is None:
+                continue
+            yield {
+                '_op_type': 'index',
+                '_index': INDEX_NAME,
+                '_id': doc_id_counter,
+                '_source': {
+                    'policy_id': filename.replace('.txt', ''),
+                    'content': content.decode('utf-8')
+                }
+            }
+            doc_id_counter += 1
+
+    # One _bulk request per chunk instead of one index request per document; files are read
+    # on the pool (in order) while streaming_bulk uploads what has already been read
+    try:
+        with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+            files = executor.map(read_policy, entries)
+            for ok, info in streaming_bulk(es_client, actions(files), chunk_size=500, request_timeout=60, raise_on_error=False):
+                result = info['index']
+                if ok:
+                    print(f"Indexed document with ID: {result['_id']}")
+                else:
+                    print(f"Error indexing document with ID {result.get('_id')}: {result.get('error')}")
+    except Exception as e:
+        # A half-loaded, never-refreshed index would be skipped as "already exists" on every later run
+        print(f"Bulk upload failed ({type(e).__name__}: {e}); deleting index '{INDEX_NAME}' so the next run reindexes.")
+        es_client.indices.delete(index=INDEX_NAME, ignore_unavailable=True)
+        raise
 
-    doc_id_counter = 1
-    for filename in os.listdir(POLICY_DIR):
-        if filename.endswith(".txt"):
-            filepath = os.path.join(POLICY_DIR, filename)
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    doc = {
-                        'policy_id': filename.replace('.txt', ''),
-                        'content': content
-                    }
-                    es_client.index(index=INDEX_NAME, id=doc_id_counter, document=doc)
-                    print(f"Indexed document: {filename} with ID: {doc_id_counter}")
-                    doc_id_counter += 1
-            except Exception as e:
-                print(f"Error reading or indexing file {filename}: {e}")
+    es_client.indices.put_settings(index=INDEX_NAME, settings={'refresh_interval': None, 'number_of_replicas': None})
+    es_client.indices.refresh(index=INDEX_NAME)
 
 
 if __name__ == "__main__":
     print("--- Starting Elasticsearch Indexing Script ---")
-    # --- Run the basic requests test first ---
-    if not test_connection_with_requests():
-        print("--- Basic HTTP connection failed. Aborting Elasticsearch client attempt. ---")
+    # create_es_client() reports connection failures itself via client.info()
+    client = create_es_client()
+    if client:
+        index_policies(client)
+        print("--- Indexing complete (or skipped) ---")
     else:
-        # If basic connection works, try the elasticsearch library
-        print("--- Basic HTTP connection succeeded. Now trying Elasticsearch library... ---")
-        client = create_es_client()
-        if client:
-            index_policies(client)
-            print("--- Indexing complete (or skipped) ---")
-        else:
-            print("--- Indexing failed: Could not connect using Elasticsearch library ---")
\ No newline at end of file
+        print("--- Indexing failed: Could not connect using Elasticsearch library ---")
\ No newline at end of file
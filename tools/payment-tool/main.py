@@ -1,6 +1,9 @@
 import os
-import psycopg2
-from fastapi import FastAPI, HTTPException
+import asyncio
+import asyncpg
+import orjson
+import msgspec
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
 from pydantic import BaseModel
 import logging
 
@@ -10,29 +13,76 @@ log = logging.getLogger(__name__)
 
 app = FastAPI()
 
-# --- Database Connection ---
-def get_db_connection():
-    """Establishes a connection to the PostgreSQL database."""
-    try:
-        conn = psycopg2.connect(
-            host=os.environ.get("DB_HOST"),
-            port=os.environ.get("DB_PORT"),
-            database=os.environ.get("DB_NAME"),
-            user=os.environ.get("DB_USER"),
-            password=os.environ.get("DB_PASSWORD")
-        )
-        log.info("Database connection successful")
-        return conn
-    except Exception as e:
-        log.error(f"Database connection failed: {e}")
-        return None
+# --- Database Connection Pool ---
+# Created on first use, so a database that is still booting when the app starts only fails the
+# requests made before it is up; requests then borrow an authenticated connection and await the
+# query, so the event loop keeps serving other requests while Postgres works
+app.state.pool = None
+_pool_lock = asyncio.Lock()
+
+
+async def get_db_pool():
+    """Returns the PostgreSQL connection pool, creating it if needed (None if the database is down)."""
+    if app.state.pool:
+        return app.state.pool
+    async with _pool_lock:
+        if app.state.pool: # Created by a concurrent request while we waited
+            return app.state.pool
+        try:
+            app.state.pool = await asyncpg.create_pool(
+                host=os.environ.get("DB_HOST"),
+                port=int(os.environ.get("DB_PORT", "5432")),
+                database=os.environ.get("DB_NAME"),
+                user=os.environ.get("DB_USER"),
+                password=os.environ.get("DB_PASSWORD"),
+                min_size=2,
+                max_size=20,
+                statement_cache_size=256, # Each connection prepares the SELECT once and reuses it
+                timeout=5
+            )
+            log.info("Database connection pool created")
+        except Exception as e:
+            log.error(f"Database connection pool creation failed: {e}")
+        return app.state.pool
+
+
+@app.on_event("startup")
+async def open_db_pool():
+    """Tries to create the pool up front; if the database is not up yet, the first request retries."""
+    await get_db_pool()
+
 
+@app.on_event("shutdown")
+async def close_db_pool():
+    """Closes every pooled PostgreSQL connection."""
+    if app.state.pool:
+        await app.state.pool.close()
 
-# --- Pydantic Models for Request/Response Validation ---
-class PaymentMethodRequest(BaseModel):
+
+# --- Request Bodies (msgspec: decoded straight from the raw body bytes in C) ---
+class PaymentMethodRequest(msgspec.Struct, frozen=True):
     user_id: int
 
 
+class RetryPaymentRequest(msgspec.Struct, frozen=True):
+    order_id: int
+    payment_method_id: str
+
+
+def msgspec_body(struct_type):
+    """Builds a FastAPI dependency that decodes the JSON request body into struct_type."""
+    decoder = msgspec.json.Decoder(struct_type, strict=False) # Accepts "7" for ints, as Pydantic did
+
+    async def decode_body(http_request: Request):
+        try:
+            return decoder.decode(await http_request.body())
+        except msgspec.DecodeError as e: # Also covers msgspec.ValidationError
+            raise HTTPException(status_code=422, detail=str(e))
+
+    return decode_body
+
+
+# --- Pydantic Models for Response Documentation/Validation ---
 class PaymentMethod(BaseModel):
     payment_method_id: str
     method_type: str
@@ -44,11 +94,6 @@ class PaymentMethodResponse(BaseModel):
 
 
 # --- NEW: Models for Retry Payment ---
-class RetryPaymentRequest(BaseModel):
-    order_id: int
-    payment_method_id: str
-
-
 class RetryPaymentResponse(BaseModel):
     status: str  # "success" or "failed"
     transaction_id: str | None = None  # Optional transaction ID on success
@@ -63,36 +108,34 @@ async def health_check():
 
 
 @app.post("/get_payment_methods", response_model=PaymentMethodResponse)
-async def get_payment_methods(request: PaymentMethodRequest):
+async def get_payment_methods(request: PaymentMethodRequest = Depends(msgspec_body(PaymentMethodRequest))):
     """Fetches payment methods for a given user_id from the database."""
-    conn = get_db_connection()
-    if not conn:
+    pool = await get_db_pool()
+    if not pool:
         raise HTTPException(status_code=503, detail="Database connection unavailable")
 
-    methods = []
     try:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT payment_method_id, method_type, status FROM payment_methods WHERE user_id = %s",
-                (request.user_id,)
-            )
-            rows = cur.fetchall()
-            for row in rows:
-                methods.append(PaymentMethod(payment_method_id=row[0], method_type=row[1], status=row[2]))
+        rows = await pool.fetch(
+            "SELECT payment_method_id, method_type, status FROM payment_methods WHERE user_id = $1",
+            request.user_id
+        )
+        # Rows come from our own schema, so the payload is built directly without model validation
+        methods = [
+            {'payment_method_id': row[0], 'method_type': row[1], 'status': row[2]}
+            for row in rows
+        ]
         log.info(f"Fetched {len(methods)} payment methods for user {request.user_id}")
-    except Exception as e:
+    except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError, asyncio.TimeoutError) as e:
         log.error(f"Error fetching payment methods: {e}")
         raise HTTPException(status_code=500, detail="Error fetching data from database")
-    finally:
-        if conn:
-            conn.close()
 
-    return PaymentMethodResponse(payment_methods=methods)
+    # Returning a Response skips response_model validation; the model still documents the schema
+    return Response(content=orjson.dumps({'payment_methods': methods}), media_type="application/json")
 
 
 # --- NEW: Retry Payment Endpoint ---
 @app.post("/retry_payment", response_model=RetryPaymentResponse)
-async def retry_payment(request: RetryPaymentRequest):
+async def retry_payment(request: RetryPaymentRequest = Depends(msgspec_body(RetryPaymentRequest))):
     """
     MOCK endpoint to simulate retrying a payment.
     - 'card_B_paypal' will succeed.